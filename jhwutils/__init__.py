@@ -1,2 +1,2 @@
-from . import checkarr, ellipse, float_inspector, image_audio,  matrices, tick, tkanvas, history
+from . import checkarr, ellipse, float_inspector, image_audio,  matrices, tick, tkanvas, history, keybundle
 
@@ -1,9 +1,375 @@
 import numpy as np
 from binascii import crc32
+import collections
+import contextlib
+import functools
+import hashlib
+import math
+import os
+import pickle
+import sqlite3
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
 
-def array_hash(arr):
-    arr = np.array(arr)
+
+# elements per block when streaming statistics
+_CHUNK = 1 << 16
+
+
+class _RunningStats:
+    """Mergeable, NaN-ignoring accumulator for max/min/sum/variance
+    and the positionally weighted sum, fed one block at a time."""
+
+    def __init__(self):
+        self.n = 0
+        self.max = -np.inf
+        self.min = np.inf
+        self.total = 0.0
+        self.m2 = 0.0
+        self.weighted = 0.0
+
+    def update(self, x, pos=None):
+        n = len(x) - np.count_nonzero(np.isnan(x))
+        if n == 0:
+            return
+        total = np.nansum(x)
+        m2 = np.nansum((x - total / n) ** 2)
+        self.max = max(self.max, np.fmax.reduce(x))
+        self.min = min(self.min, np.fmin.reduce(x))
+        if pos is not None:
+            self.weighted += np.nansum(x * pos)
+        self._combine(n, total, m2)
+
+    def merge(self, other):
+        if other.n == 0:
+            return
+        self.max = max(self.max, other.max)
+        self.min = min(self.min, other.min)
+        self.weighted += other.weighted
+        self._combine(other.n, other.total, other.m2)
+
+    def _combine(self, n, total, m2):
+        # Chan et al. pairwise update of the sum of squared deviations
+        if self.n > 0:
+            delta = total / n - self.total / self.n
+            m2 = m2 + delta ** 2 * self.n * n / (self.n + n)
+        self.n += n
+        self.total += total
+        self.m2 += m2
+
+    def stats(self, median):
+        if self.n == 0:
+            return (np.nan,) * 5 + (0.0, self.weighted)
+        mean = self.total / self.n
+        # np.nanstd is nan whenever the mean is not finite
+        std = np.sqrt(self.m2 / self.n) if np.isfinite(mean) else np.nan
+        return (self.max, self.min, mean, median, std, self.total, self.weighted)
+
+
+CacheInfo = collections.namedtuple(
+    "CacheInfo", ["hits", "misses", "disk_hits", "currsize", "maxsize"]
+)
+
+
+class _HashCache:
+    """Bounded LRU of hash results keyed by content digest, optionally
+    backed by an sqlite file shared between runs."""
+
+    def __init__(self, maxsize=256, path=None):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.disk_hits = 0
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS hashes (key TEXT PRIMARY KEY, value BLOB)")
+            self.db.commit()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            if self.db is not None:
+                row = self.db.execute("SELECT value FROM hashes WHERE key=?", (key,)).fetchone()
+                if row is not None:
+                    self.disk_hits += 1
+                    self._remember(key, pickle.loads(row[0]))
+                    return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            self._remember(key, value)
+            if self.db is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO hashes VALUES (?, ?)", (key, pickle.dumps(value))
+                )
+                self.db.commit()
+
+    def _remember(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.disk_hits, len(self.entries), self.maxsize)
+
+
+_hash_cache = None
+
+
+def enable_hash_cache(maxsize=256, path=None):
+    """Memoise array_hash, moment_hash and strict_array_hash on array content.
+    Keeps `maxsize` results in memory and, if `path` is given, every result
+    in an sqlite file there.
+
+    Every call digests the whole array to find its key. With xxhash installed
+    that is a small fraction of the cost of hashing; without it, the blake2b
+    fallback costs about two thirds of an array_hash, so a hit saves little
+    and a miss costs more than no cache. Install xxhash (the `fast` extra)."""
+    global _hash_cache
+    _hash_cache = _HashCache(maxsize, path)
+
+
+def disable_hash_cache():
+    global _hash_cache
+    _hash_cache = None
+
+
+def hash_cache_info():
+    """Hit/miss counters of the hash cache, or None if it is disabled."""
+    return None if _hash_cache is None else _hash_cache.info()
+
+
+def _content_digest(arr):
+    # dtype, shape, strides and a fast digest of the raw buffer
+    h = xxhash.xxh3_128() if xxhash is not None else hashlib.blake2b(digest_size=16)
+    h.update(f"{arr.dtype.str}{arr.shape}{arr.strides}".encode("ascii"))
+    h.update(memoryview(np.ascontiguousarray(arr)).cast("B"))
+    return h.hexdigest()
+
+
+def _cached(fn):
+    @functools.wraps(fn)
+    def cached_fn(arr, *args, **kwargs):
+        cache = _hash_cache
+        if cache is None:
+            return fn(arr, *args, **kwargs)
+        arr = np.asarray(arr)
+        if arr.dtype.hasobject:
+            return fn(arr, *args, **kwargs)
+        key = fn.__name__ + ":" + _content_digest(arr)
+        value = cache.get(key)
+        if value is None:
+            value = fn(arr, *args, **kwargs)
+            cache.put(key, value)
+        return value
+
+    return cached_fn
+
+
+_scratch = threading.local()
+
+# scratch buffers up to this many elements (8 MiB) are kept for reuse;
+# larger ones are released when the hash that needed them finishes
+scratch_keep = 1 << 20
+
+
+@contextlib.contextmanager
+def _scratch_buffer(size):
+    """A float64 buffer of `size` elements, reused across calls on the
+    same thread (grown when needed, and dropped afterwards if larger than
+    `scratch_keep`)."""
+    buf = getattr(_scratch, "buf", None)
+    if buf is None or len(buf) < size:
+        buf = _scratch.buf = np.empty(size)
+    try:
+        yield buf[:size]
+    finally:
+        if len(buf) > scratch_keep:
+            _scratch.buf = None
+
+
+def clear_scratch():
+    """Release this thread's hashing scratch buffer."""
+    _scratch.buf = None
+
+
+def _streamable(arr):
+    return arr.size > 0 and (arr.dtype.kind in "biuf")
+
+
+def _sharded(run, size, chunk_size=_CHUNK, workers=1):
+    """Call `run(lo, hi)` on `workers` contiguous, block-aligned shards of
+    range(size), on a thread pool if workers > 1, and return the results."""
+    n_chunks = -(-size // chunk_size)
+    workers = max(1, min(workers or 1, n_chunks))
+    if workers == 1:
+        return [run(0, size)]
+    bounds = [min(size, (n_chunks * i // workers) * chunk_size) for i in range(workers + 1)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(run, bounds[:-1], bounds[1:]))
+
+
+def _stream(fill, size, buf=None, positions=True, chunk_size=_CHUNK, workers=1):
+    """Accumulate `size` streamed values, one block at a time, and return
+    the merged _RunningStats.
+    `fill(start, stop, out)` writes values [start, stop) as float64 into `out`.
+    If `buf` is given (length `size`), the values are left in it, otherwise a
+    block-sized scratch buffer is reused. `positions` may be a function
+    `positions(start, stop, out)` giving each value's index for the weighted
+    sum, if that is not its stream position."""
+
+    def run(lo, hi):
+        acc = _RunningStats()
+        k = min(chunk_size, hi - lo)
+        scratch = np.empty(k) if buf is None else None
+        pos, pos_buf = np.arange(k, dtype=np.float64), np.empty(k)
+        for start in range(lo, hi, chunk_size):
+            stop = min(start + chunk_size, hi)
+            k = stop - start
+            out = scratch[:k] if buf is None else buf[start:stop]
+            fill(start, stop, out)
+            if callable(positions):
+                positions(start, stop, pos_buf[:k])
+                acc.update(out, pos_buf[:k])
+            elif positions:
+                np.add(pos[:k], start, out=pos_buf[:k])
+                acc.update(out, pos_buf[:k])
+            else:
+                acc.update(out)
+        return acc
+
+    acc = _RunningStats()
+    for part in _sharded(run, size, chunk_size, workers):
+        acc.merge(part)
+    return acc
+
+
+def _select_median(buf, n):
+    """Median of the `n` non-NaN values in `buf`, selected in place.
+    NaNs are counted by the caller, not masked out: introselect leaves them
+    at the end, so the middle ranks of the first n slots are the median."""
+    if n == 0:
+        return np.nan
+    return _select_middle(buf, (n - 1) // 2, n // 2)
+
+
+def _select_middle(buf, a, b):
+    # mean of the values of rank a and b (a == b for odd counts)
+    buf.partition(sorted({a, b}))
+    return buf[a] if a == b else (buf[a] + buf[b]) / 2
+
+
+def _histogram_median(fill, size, lo, hi, n, bins=4096, budget=_CHUNK, chunk_size=_CHUNK):
+    """Exact NaN-ignoring median of a stream of `n` valid values in [lo, hi],
+    without holding the stream in memory: narrow the range by repeated
+    histogram passes until the bins holding the middle ranks are small
+    enough to select from."""
+    if n == 0:
+        return np.nan
+    if not (np.isfinite(lo) and np.isfinite(hi)):
+        return None
+    scratch = np.empty(min(chunk_size, size))
+    ranks = np.array([(n - 1) // 2, n // 2])
+    below, closed = 0, True
+
+    def blocks(lo, hi, closed):
+        for start in range(0, size, chunk_size):
+            stop = min(start + chunk_size, size)
+            x = scratch[: stop - start]
+            fill(start, stop, x)
+            yield x[(x >= lo) & ((x <= hi) if closed else (x < hi))]
+
+    while lo != hi:
+        # select directly once the range is too narrow to split into
+        # distinct float bins, or too wide for its width to be finite
+        if not np.isfinite(hi - lo) or hi - lo <= 4 * bins * np.spacing(max(-lo, hi)):
+            break
+        counts = np.zeros(bins, dtype=np.int64)
+        for x in blocks(lo, hi, closed):
+            counts += np.histogram(x, bins=bins, range=(lo, hi))[0]
+        edges = np.linspace(lo, hi, bins + 1)
+        cum = np.cumsum(counts)
+        j0, j1 = np.searchsorted(cum, ranks - below, side="right")
+        if j0 != j1:
+            # the two middle ranks straddle bins: they are the largest value
+            # of the lower bin and the smallest of the upper one
+            last = closed and j1 == bins - 1
+            a = max(np.max(x, initial=-np.inf) for x in blocks(edges[j0], edges[j0 + 1], False))
+            b = min(np.min(x, initial=np.inf) for x in blocks(edges[j1], edges[j1 + 1], last))
+            return (a + b) / 2
+        below += cum[j0 - 1] if j0 > 0 else 0
+        lo, hi = edges[j0], edges[j0 + 1]
+        closed = closed and j0 == bins - 1
+        if counts[j0] <= budget:
+            break
+    else:
+        return lo
+    picked = np.concatenate(list(blocks(lo, hi, closed)))
+    return _select_middle(picked, *(ranks - below))
+
+
+def _copy_fill(flat):
+    def fill(start, stop, out):
+        out[:] = flat[start:stop]
+
+    return fill
+
+
+def _fill_all(fill, buf, chunk_size=_CHUNK, workers=1):
+    def run(lo, hi):
+        for start in range(lo, hi, chunk_size):
+            fill(start, min(start + chunk_size, hi), buf[start : min(start + chunk_size, hi)])
+
+    _sharded(run, len(buf), chunk_size, workers)
+
+
+def _stored_order(arr):
+    """(flat, shape, positions) to stream `arr` without copying it: a
+    C-contiguous array as it is; a Fortran-ordered one (e.g. saved from a
+    transpose) in its stored order, as arr.T with each value's C-order index
+    as its position; anything else through arr.flat, a block at a time."""
+    if arr.flags.c_contiguous:
+        return arr.reshape(-1), arr.shape, True
+    if arr.flags.f_contiguous:
+        shape = arr.shape
+
+        def positions(start, stop, out):
+            ix = np.unravel_index(np.arange(start, stop), shape[::-1])
+            out[:] = np.ravel_multi_index(ix[::-1], shape)
+
+        return arr.T.reshape(-1), shape[::-1], positions
+    return arr.flat, arr.shape, True
+
+
+def _fingerprint(fill, size, chunk_size=_CHUNK, in_memory=True, workers=1, positions=True):
+    if in_memory:
+        with _scratch_buffer(size) as buf:
+            acc = _stream(fill, size, buf=buf, positions=positions, chunk_size=chunk_size, workers=workers)
+            return acc.stats(_select_median(buf, acc.n))
+    acc = _stream(fill, size, positions=positions, chunk_size=chunk_size, workers=workers)
+    median = _histogram_median(fill, size, acc.min, acc.max, acc.n, chunk_size=chunk_size)
+    if median is not None:
+        return acc.stats(median)
+    # non-finite range; fall back to selecting from a full copy
+    with _scratch_buffer(size) as buf:
+        _fill_all(fill, buf, chunk_size, workers)
+        return acc.stats(_select_median(buf, acc.n))
+
+
+def _array_hash_direct(arr):
     shape = arr.shape
     flat = arr.ravel()
 
@@ -19,10 +385,81 @@ def array_hash(arr):
     return shape, np.nansum(stats)
 
 
-def moment_hash(arr):
-    arr = np.array(arr)
-    shape = arr.shape
-    flat = arr.ravel()
+@_cached
+def array_hash(arr, chunk_size=_CHUNK, workers=1):
+    """Return (shape, fingerprint) for an array.
+    Statistics are accumulated in a single blocked pass; the result agrees
+    with the direct NumPy reductions to within the `check_hash` tolerance.
+    With workers > 1, shards of the array are reduced on that many threads
+    and their partial statistics merged."""
+    arr = np.asarray(arr)
+    if not _streamable(arr):
+        return _array_hash_direct(np.array(arr))
+    flat, _, positions = _stored_order(arr)
+    stats = _fingerprint(_copy_fill(flat), arr.size, chunk_size, workers=workers, positions=positions)
+    return arr.shape, np.nansum(stats)
+
+
+def array_hash_file(fname, chunk_size=_CHUNK, workers=1):
+    """As `array_hash`, but for a .npy file, which is memory-mapped and
+    streamed rather than loaded (the median is found by histogram refinement).
+    Fortran-ordered files are streamed in their stored order."""
+    arr = np.load(fname, mmap_mode="r")
+    if not _streamable(arr):
+        return _array_hash_direct(np.array(arr))
+    flat, _, positions = _stored_order(arr)
+    stats = _fingerprint(
+        _copy_fill(flat), arr.size, chunk_size, in_memory=False, workers=workers, positions=positions
+    )
+    return arr.shape, np.nansum(stats)
+
+
+def _moment_fill(flat, power):
+    def fill(start, stop, out):
+        out[:] = flat[start:stop]
+        for _ in range(power):
+            out *= np.arange(start, stop, dtype=np.float64)
+
+    return fill
+
+
+def _moment_stats(flat, chunk_size=_CHUNK, workers=1):
+    """Statistics of flat * m ** i for i = 0, 1, 2, from one blocked pass
+    (medians from a single reused full-size buffer)."""
+    size = len(flat)
+
+    def run(lo, hi):
+        accs = [_RunningStats() for i in range(3)]
+        k = min(chunk_size, hi - lo)
+        x, f = np.empty(k), np.empty(k)
+        pos, pos_buf = np.arange(k, dtype=np.float64), np.empty(k)
+        for start in range(lo, hi, chunk_size):
+            stop = min(start + chunk_size, hi)
+            k = stop - start
+            x[:k] = flat[start:stop]
+            np.add(pos[:k], start, out=pos_buf[:k])
+            accs[0].update(x[:k])
+            np.multiply(x[:k], pos_buf[:k], out=f[:k])
+            accs[1].update(f[:k])
+            np.multiply(f[:k], pos_buf[:k], out=f[:k])
+            accs[2].update(f[:k])
+        return accs
+
+    accs = [_RunningStats() for i in range(3)]
+    for parts in _sharded(run, size, chunk_size, workers):
+        for acc, part in zip(accs, parts):
+            acc.merge(part)
+
+    stats = []
+    with _scratch_buffer(size) as buf:
+        for i, acc in enumerate(accs):
+            _fill_all(_moment_fill(flat, i), buf, chunk_size, workers)
+            median = _select_median(buf, acc.n)
+            stats.append(acc.stats(median)[:6])
+    return stats
+
+
+def _moment_stats_direct(flat):
     m = np.arange(len(flat))
 
     stats = []
@@ -37,15 +474,88 @@ def moment_hash(arr):
             np.nansum(f),
         )
         stats.append(m_stats)
+    return stats
+
+
+@_cached
+def moment_hash(arr, chunk_size=_CHUNK, workers=1):
+    """Return a hex string hashing the shape and the statistics of
+    flat * m ** i, i = 0, 1, 2, where m is the flat index.
+
+    The statistics are accumulated blockwise, so they can differ from the
+    direct NumPy reductions in the last few ulps. The string is therefore
+    identical to the direct computation unless the total lies within about
+    1e-12 (relative) of a rounding boundary of the `1.5e` formatting.
+    `workers` is as for `array_hash`."""
+    arr = np.asarray(arr)
+    shape = arr.shape
+    flat = arr.ravel()
+    if _streamable(arr):
+        stats = _moment_stats(flat, chunk_size, workers)
+    else:
+        stats = _moment_stats_direct(np.array(flat))
 
     shape_hash = hex(crc32(f"{shape}".encode("utf8")))
     return shape_hash[2:] + _check_scalar(np.nansum(stats))[2:]
 
 
-def strict_array_hash(arr):
+def _strict_fill(flat, shape):
+    # weight of each element is the mean of its indices along every axis.
+    # Per block, the sum of the leading indices is found for each row of the
+    # last axis and broadcast against an arange of the column indices, so no
+    # index grids are ever formed
+    last = shape[-1]
+
+    def fill(start, stop, out):
+        r0, r1 = start // last, (stop - 1) // last + 1
+        rows = np.arange(r0, r1)
+        prefix = np.zeros(r1 - r0)
+        zero = np.zeros(r1 - r0, dtype=bool)
+        for dim in reversed(shape[:-1]):
+            rows, r = np.divmod(rows, dim)
+            prefix += r
+            zero |= r == 0
+        lo, hi = start - r0 * last, stop - r0 * last
+        if r1 - r0 == 1:
+            cols = np.arange(lo, hi)
+            weight = prefix[0] + cols
+        else:
+            cols = np.arange(last)
+            weight = np.add.outer(prefix, cols).ravel()[lo:hi]
+        weight /= len(shape)
+        np.multiply(flat[start:stop], weight, out=out)
+        if not np.isfinite(out).all():
+            # the direct form multiplies inf by a zero index and gets nan
+            if r1 - r0 == 1:
+                at_zero = zero[0] | (cols == 0)
+            else:
+                at_zero = np.logical_or.outer(zero, cols == 0).ravel()[lo:hi]
+            out[at_zero & np.isinf(flat[start:stop])] = np.nan
+
+    return fill
+
+
+def _strict_array_hash_direct(arr):
     ix = np.meshgrid(*[np.arange(i) for i in arr.shape], indexing="ij")
     return array_hash(np.mean([i*arr for i in ix], axis=0))
 
+
+@_cached
+def strict_array_hash(arr, chunk_size=_CHUNK, workers=1):
+    """array_hash of the array weighted elementwise by the mean of its indices.
+    The weighted array is never materialised: blocks are generated on the
+    fly and the median found by histogram refinement, so extra memory is
+    bounded by the block size. `workers` is as for `array_hash`."""
+    arr = np.asarray(arr)
+    if not _streamable(arr) or arr.ndim == 0:
+        return _strict_array_hash_direct(arr)
+    # the weights (mean index) are the same whichever order the axes are in
+    flat, shape, positions = _stored_order(arr)
+    fill = _strict_fill(flat, shape)
+    stats = _fingerprint(fill, arr.size, chunk_size, in_memory=False, workers=workers, positions=positions)
+    return arr.shape, np.nansum(stats)
+
+
 def check_hash(arr, test, strict=False):
     if strict:
         sh, stats = strict_array_hash(arr)
@@ -68,6 +578,57 @@ def _check_scalar(x, tol=5):
     hash_f = hex(crc32(formatted.encode("ascii")))
     return hash_f
 
+_crc_table = None
+
+
+def _crc32_rows(rows, lengths):
+    """CRC-32 (as binascii.crc32) of each row of a uint8 matrix, over its
+    first `lengths` bytes, computed column by column for all rows at once."""
+    global _crc_table
+    if _crc_table is None:
+        c = np.arange(256, dtype=np.uint32)
+        for _ in range(8):
+            c = np.where(c & 1, np.uint32(0xEDB88320) ^ (c >> 1), c >> 1)
+        _crc_table = c
+    crc = np.full(len(rows), 0xFFFFFFFF, dtype=np.uint32)
+    for j in range(rows.shape[1]):
+        step = _crc_table[(crc ^ rows[:, j]) & 0xFF] ^ (crc >> 8)
+        crc = np.where(j < lengths, step, crc)
+    return crc ^ np.uint32(0xFFFFFFFF)
+
+
+def _scalar_crcs(xs, tol=5):
+    # CRCs of the `1.{tol}e` formatting of every value: all values are
+    # formatted by one %-operation into a packed, comma-separated buffer
+    packed = ((f"%1.{tol}e," * len(xs)) % tuple(xs.tolist())).encode("ascii")
+    packed = np.frombuffer(packed, dtype=np.uint8)
+    ends = np.flatnonzero(packed == ord(","))
+    starts = np.concatenate([[0], ends[:-1] + 1])[: len(ends)]
+    lengths = ends - starts
+    cols = np.arange(lengths.max(initial=0))
+    rows = packed[np.minimum(starts[:, None] + cols, len(packed) - 1)]
+    return _crc32_rows(rows, lengths)
+
+
+def _scalar_windows(xs, tol=5):
+    # CRCs of x and x +/- a tenth of the last formatted digit: shape (n, 3)
+    xs = np.asarray(xs)
+    if xs.dtype.kind != "f":
+        xs = xs.astype(np.float64)
+    xs = xs.reshape(-1)
+    offsets = 10 ** (-tol) * xs * 0.1
+    probes = np.concatenate([xs, xs + offsets, xs - offsets])
+    return _scalar_crcs(probes, tol).reshape(3, -1).T
+
+
+def check_scalars(values, hashes, tol=5):
+    """Vectorised check_scalar: a boolean mask that is True where each value
+    matches its hash (as produced by _check_scalar) within the tolerance."""
+    windows = _scalar_windows(values, tol)
+    expected = np.array([int(h, 16) for h in np.ravel(hashes)], dtype=np.uint32)
+    return (windows == expected[:, None]).any(axis=1).reshape(np.shape(values))
+
+
 def check_scalar(x, h, tol=5):
     offset = 10 ** (-tol) * x * 0.1
     ctr = _check_scalar(x, tol)
@@ -78,18 +639,258 @@ def check_scalar(x, h, tol=5):
         return False
     return True
 
+# Bucket hashes: a value is quantised to a bucket of width 10**(e - tol),
+# where e is its decimal exponent, and the CRC of (e, bucket) is stored.
+# A checked value matches if the stored hash is its own bucket or the
+# nearer neighbouring bucket, so anything within half a bucket of the
+# reference always matches, wherever the rounding boundaries fall.
+_BUCKET_SPECIAL = {"zero": -(2 ** 31), "nan": 2 ** 31, "inf": 2 ** 31 + 1}
+
+# correctly rounded 10**k for k in [-_POW10_BIAS, _POW10_BIAS), so the scalar
+# and array forms of the bucket width agree to the last bit
+_POW10_BIAS = 400
+_POW10 = [float(10 ** k) if k >= 0 else 1 / 10 ** -k for k in range(-_POW10_BIAS, 309)]
+_POW10 += [math.inf] * (2 * _POW10_BIAS - len(_POW10))
+_POW10_ARRAY = np.array(_POW10)
+_pack_bucket = struct.Struct("<qq").pack
+
+
+def _bucket_crcs(e, b):
+    pairs = np.stack([e, b], axis=-1).astype("<i8")
+    rows = pairs.view(np.uint8).reshape(len(pairs), 16)
+    return _crc32_rows(rows, np.full(len(pairs), 16))
+
+
+def _bucket_probes(xs, tol, neighbours=True):
+    """(n, k) CRCs to accept for each value: its bucket first, then the
+    nearer neighbour, and the same again at the adjacent exponent for values
+    within a bucket of a power of ten."""
+    xs = np.asarray(xs, dtype=np.float64).reshape(-1)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        mag = np.abs(xs)
+        finite = np.isfinite(xs) & (mag > 0)
+
+        def exponent(m):
+            return np.where(finite, np.floor(np.log10(np.where(finite, m, 1.0))), 0)
+
+        e0 = exponent(mag)
+        e_up, e_down = exponent(mag * (1 + 10.0 ** -tol)), exponent(mag * (1 - 10.0 ** -tol))
+        e_other = np.where(e_up != e0, e_up, e_down)
+        special = np.where(
+            np.isnan(xs),
+            _BUCKET_SPECIAL["nan"],
+            np.where(mag == 0, _BUCKET_SPECIAL["zero"], _BUCKET_SPECIAL["inf"]),
+        )
+        probes = []
+        for e in ([e0, e_other] if neighbours else [e0]):
+            width = _POW10_ARRAY[np.clip(e - tol, -_POW10_BIAS, _POW10_BIAS - 1).astype(int) + _POW10_BIAS]
+            q = np.where(finite, xs / width, 0)
+            b = np.floor(q)
+            near = np.where(q - b >= 0.5, b + 1, b - 1)
+            e_code = np.where(finite, e, special)
+            b_code = np.where(finite, b, np.sign(np.nan_to_num(xs)))
+            probes.append(_bucket_crcs(e_code, b_code))
+            if neighbours:
+                probes.append(_bucket_crcs(e_code, np.where(finite, near, b_code)))
+    return np.stack(probes, axis=1)
+
+
+def _bucket_probes_scalar(x, tol, neighbours=True):
+    """The CRCs of _bucket_probes for a single value, in the same order but
+    generated lazily in plain Python, so a check can stop at the first match
+    without paying for the array set-up."""
+    x = float(x)
+    mag = abs(x)
+    if not (math.isfinite(x) and mag > 0):
+        if math.isnan(x):
+            e, b = _BUCKET_SPECIAL["nan"], 0
+        elif mag == 0:
+            e, b = _BUCKET_SPECIAL["zero"], 0
+        else:
+            e, b = _BUCKET_SPECIAL["inf"], 1 if x > 0 else -1
+        yield crc32(_pack_bucket(e, b))
+        return
+    e = math.floor(math.log10(mag))
+    for k in range(2 if neighbours else 1):
+        if k == 1:
+            # the adjacent exponent, for values near a power of ten
+            other = e
+            for m in (mag * (1 + 10.0 ** -tol), mag * (1 - 10.0 ** -tol)):
+                if other == e and 0 < m < math.inf:
+                    other = math.floor(math.log10(m))
+            e = other
+        width = _POW10[e - tol + _POW10_BIAS]
+        if width == 0:
+            # the bucket width underflows (deep subnormals): use the array form
+            yield from (int(h) for h in _bucket_probes([x], tol, neighbours)[0][2 * k :])
+            return
+        q = x / width
+        b = math.floor(q)
+        yield crc32(_pack_bucket(e, b))
+        if neighbours:
+            yield crc32(_pack_bucket(e, b + 1 if q - b >= 0.5 else b - 1))
+
+
+def bucket_hashes(values, tol=5):
+    """Bucket hashes (uint32) of each value, to be checked with
+    check_buckets or check_bucket."""
+    return _bucket_probes(values, tol, neighbours=False)[:, 0].reshape(np.shape(values))
+
+
+def bucket_hash(x, tol=5):
+    return hex(next(_bucket_probes_scalar(x, tol, neighbours=False)))
+
+
+def check_buckets(values, hashes, tol=5):
+    """Boolean mask, True where each value is within tolerance of the value
+    its bucket hash was made from. `hashes` may be a uint32 array or hex
+    strings."""
+    hashes = np.ravel(hashes)
+    if hashes.dtype.kind in "US":
+        hashes = np.array([int(h, 16) for h in hashes], dtype=np.uint32)
+    probes = _bucket_probes(values, tol)
+    return (probes == hashes.astype(np.uint32)[:, None]).any(axis=1).reshape(np.shape(values))
+
+
+def check_bucket(x, h, tol=5):
+    if isinstance(h, str):
+        h = int(h, 16)
+    if int(h) not in _bucket_probes_scalar(x, tol):
+        print(f"Warning: Got {x:1.5e} -> {bucket_hash(x, tol)}, expected {h}")
+        return False
+    return True
+
+
 def check_string(s, h):
     hash_f = hex(crc32(f"{s.lower()}".encode("utf8")))
     if hash_f != h:
         print(f"Warning: Got {s} -> {hash_f}, expected {h}")
     return hash_f == h
 
+def check_key(value, name, bundle):
+    """Check `value` against the key `name` of an answer-key bundle
+    (a KeyBundle or the path of one), using the check kind recorded for it."""
+    from .keybundle import open_bundle
+
+    bundle = open_bundle(bundle)
+    kind, expected = bundle.check_kind(name), bundle[name]
+    if kind in ("hash", "strict"):
+        return check_hash(value, expected, strict=kind == "strict")
+    if kind == "moment":
+        got = moment_hash(value)
+        if got != expected:
+            print(f"Got hash {got} but expected {expected}")
+        return got == expected
+    if kind == "scalar":
+        return check_scalar(value, expected)
+    if kind == "string":
+        return check_string(value, expected)
+    raise ValueError(f"Key {name!r} has no checkarr check kind")
+
+
 def check_anagram(l):
     return check_string("".join(sorted(l)))
 
 def check_list(l):
     return check_string("".join(l))
 
+_verify_dtype = [("ok", "?"), ("kind", "U8"), ("got", "O"), ("expected", "O")]
+
+
+def _verify_row(check, *args):
+    # one bad value fails its own row, with the exception as what was got
+    try:
+        return check(*args)
+    except Exception as e:
+        return False, repr(e)
+
+
+def _verify_string(value, expected):
+    got = hex(crc32(f"{value.lower()}".encode("utf8")))
+    return got == expected, got
+
+
+def _verify_scalars(values, hashes, tol):
+    windows = _scalar_windows(values, tol)
+    return [(int(h, 16) in window, hex(window[0])) for h, window in zip(hashes, windows)]
+
+
+def _verify_array(value, expected, kind, options):
+    if kind == "moment":
+        got = moment_hash(value)
+        return got == expected, got
+    strict = kind == "strict" or options.get("strict", False)
+    got = strict_array_hash(value) if strict else array_hash(value)
+    ok = got[0] == tuple(expected[0]) and np.allclose(got[1], expected[1], rtol=1e-5, atol=1e-5)
+    return ok, got
+
+
+def verify_batch(pairs, workers=None):
+    """Check many answers at once, without printing.
+
+    `pairs` is a sequence of (value, expected, kind[, options]) where kind is
+    one of "hash", "strict", "moment", "scalar" or "string" and options is a
+    dict ({"strict": True} for "hash", {"tol": 5} for "scalar").
+    Scalars are checked together per tolerance; array hashes run on a thread
+    pool of `workers` threads (NumPy reductions release the GIL).
+
+    Returns a structured array with fields ok, kind, got and expected, one
+    row per pair, in order. A value that cannot be checked at all fails its
+    row, with the repr of the exception in got.
+    """
+    results = np.zeros(len(pairs), dtype=_verify_dtype)
+    scalars = {}
+    arrays = []
+    for i, pair in enumerate(pairs):
+        value, expected, kind = pair[:3]
+        options = pair[3] if len(pair) > 3 else {}
+        results[i]["kind"], results[i]["expected"] = kind, expected
+        if kind == "scalar":
+            scalars.setdefault(options.get("tol", 5), []).append(i)
+        elif kind == "string":
+            results[i]["ok"], results[i]["got"] = _verify_row(_verify_string, value, expected)
+        elif kind in ("hash", "strict", "moment"):
+            arrays.append((i, value, expected, kind, options))
+        else:
+            raise ValueError(f"Unknown check kind {kind!r}")
+
+    for tol, ixs in scalars.items():
+        try:
+            checked = _verify_scalars([pairs[i][0] for i in ixs], [pairs[i][1] for i in ixs], tol)
+        except Exception:
+            # find the bad rows by checking one at a time
+            checked = [_verify_row(lambda *a: _verify_scalars(*a)[0], [pairs[i][0]], [pairs[i][1]], tol) for i in ixs]
+        for i, (ok, got) in zip(ixs, checked):
+            results[i]["ok"], results[i]["got"] = ok, got
+
+    if arrays:
+        workers = workers or min(len(arrays), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            done = pool.map(lambda a: _verify_row(_verify_array, *a[1:]), arrays)
+            for (i, *_), (ok, got) in zip(arrays, done):
+                results[i]["ok"], results[i]["got"] = ok, got
+    return results
+
+
+def _benchmark_strict(max_bytes=1 << 30):
+    """Time strict_array_hash and trace its peak allocation on 4-D arrays
+    of doubling size, up to `max_bytes` of input."""
+    import time, tracemalloc
+
+    side = 8
+    while side ** 4 * 8 <= max_bytes:
+        arr = np.random.uniform(-1, 1, (side,) * 4)
+        tracemalloc.start()
+        t = time.perf_counter()
+        strict_array_hash(arr)
+        t = time.perf_counter() - t
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{arr.shape} {arr.nbytes / 2**20:8.1f}MiB  {t:7.3f}s  peak extra {peak / 2**20:6.2f}MiB")
+        side *= 2
+
+
 if __name__ == "__main__":
     check_scalar(0.01000, "0x5ecf2a74")
     print(moment_hash(np.ones((5, 5))))
+    _benchmark_strict(1 << 28)
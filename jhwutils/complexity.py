@@ -1,11 +1,19 @@
 # JHW 2019
 
 import timeit
+import tracemalloc
 import matplotlib.pyplot as plt
 import numpy as np
 import scipy.optimize
 import scipy.special
 import time
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 
 complexities = {
@@ -19,37 +27,287 @@ complexities = {
     "factorial": lambda n: scipy.special.gamma(n),
 }
 
+# Logarithms of the basis functions that overflow for large n; these are
+# evaluated in log space and rescaled, so sweeps to large n fit correctly
+log_complexities = {
+    "exp": lambda n: n * np.log(2),
+    "factorial": lambda n: scipy.special.gammaln(n),
+}
+
+# Further classes that can be added with register_complexity. A tuple of
+# functions is a multi-term model, fitted as a linear combination.
+extra_complexities = {
+    "n^1.5": lambda n: n ** 1.5,
+    "nlog2n": lambda n: n * np.log(n) ** 2,
+    "polylog": lambda n: np.log(n) ** 2,
+    "n+nlogn": (lambda n: n, lambda n: n * np.log(n)),
+    "n+n^2": (lambda n: n, lambda n: n ** 2),
+}
+
+
+def power_complexity(k):
+    """Basis function for the class n^k."""
+    return lambda n: n ** k
+
+
+def register_complexity(name, *terms, log=None):
+    """Add a class to `complexities`: register_complexity("n^4",
+    power_complexity(4)), or several terms for a two-term (or more) model,
+    e.g. register_complexity("n+nlogn", lambda n: n, lambda n: n * np.log(n)).
+    For a single term that overflows, `log` gives its logarithm."""
+    complexities[name] = terms[0] if len(terms) == 1 else tuple(terms)
+    if log is not None:
+        log_complexities[name] = log
+
+
+def _terms(c):
+    return c if isinstance(c, tuple) else (c,)
+
+
 def complexity_fit(x, fn, ns, ts):
     return np.sum((x * fn(ns) - ts) ** 2)
 
 
+def fit_complexities(ns, ts, classes=None):
+    """Least-squares fit of every complexity class to one or many sweeps.
+
+    Each model is linear in its coefficients, so all the basis functions
+    are evaluated once into a design matrix and every coefficient solved in
+    closed form. ts is (len(ns),) or (sweeps, len(ns)).
+
+    Returns (names, coeffs, residuals, fitted): coeffs[k] is the (terms,
+    sweeps) coefficient array of class k, residuals is (sweeps, classes) of
+    residual sums of squares and fitted is (classes, sweeps, len(ns))."""
+    classes = complexities if classes is None else classes
+    ns = np.asarray(ns, dtype=np.float64)
+    ts = np.atleast_2d(np.asarray(ts, dtype=np.float64))
+    names = list(classes)
+    coeffs, fitted = [], []
+    for name in names:
+        basis, log_scale = _scaled_basis(name, classes[name], ns)
+        if not np.all(np.isfinite(basis)):
+            coeffs.append(np.full((basis.shape[1], len(ts)), np.nan))
+            fitted.append(np.full(ts.shape, np.nan))
+            continue
+        if basis.shape[1] == 1:
+            b = basis[:, 0]
+            x = (ts @ b / max(b @ b, np.finfo(float).tiny))[None, :]
+        else:
+            x = np.linalg.lstsq(basis, ts.T, rcond=None)[0]
+        fitted.append((basis @ x).T)
+        # back to the unscaled basis (may underflow to 0 for huge scales)
+        coeffs.append(x * np.exp(-log_scale)[:, None])
+    fitted = np.array(fitted)
+    residuals = np.sum((fitted - ts[None]) ** 2, axis=2).T
+    residuals[~np.isfinite(residuals)] = np.inf
+    return names, coeffs, residuals, fitted
+
+
+def _scaled_basis(name, c, ns):
+    """Design matrix columns for class `c`, each scaled to a maximum of 1,
+    and the log of each column's scale. Classes with a log form are
+    evaluated as exp(log f(n) - max log f(n)), so they never overflow."""
+    if name in log_complexities and not isinstance(c, tuple):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_b = np.asarray(log_complexities[name](ns), dtype=np.float64)
+        log_max = np.max(log_b) if np.all(np.isfinite(log_b) | (log_b == -np.inf)) else np.nan
+        return np.exp(log_b - log_max)[:, None], np.array([log_max])
+    with np.errstate(over="ignore", invalid="ignore", divide="ignore"):
+        basis = np.stack([np.broadcast_to(t(ns), ns.shape) for t in _terms(c)], axis=1).astype(np.float64)
+    scale = np.max(np.abs(basis), axis=0)
+    scale = np.where((scale > 0) & np.isfinite(scale), scale, 1.0)
+    return basis / scale, np.log(scale)
+
+
+def score_complexities(residuals):
+    """Relative scores (summing to 1 per sweep) from residual sums of squares."""
+    scores = 1.0 / np.sqrt(np.maximum(residuals, np.finfo(float).tiny))
+    return scores / np.sum(scores, axis=-1, keepdims=True)
+
+
+def loglog_slope(ns, ts):
+    """Slope of log(ts) against log(ns): the exponent k of a power law
+    n^k. ts may be (len(ns),) or (sweeps, len(ns))."""
+    ts = np.asarray(ts, dtype=np.float64)
+    logn = np.log(np.asarray(ns, dtype=np.float64))
+    design = np.stack([logn, np.ones_like(logn)], axis=1)
+    slope = np.linalg.lstsq(design, np.log(np.atleast_2d(ts)).T, rcond=None)[0][0]
+    return slope if ts.ndim > 1 else slope[0]
+
+
+def _time_cell(fn, n, number, setup, extra_globals):
+    return timeit.timeit(
+        "fn(n)",
+        setup=setup,
+        globals={**globals(), "fn": fn, "n": n, **extra_globals},
+        number=number,
+    )
+
+
+def _adaptive_cell(fn, n, setup, extra_globals, max_reps, target_time, rel_ci, min_reps=5):
+    """Time fn(n) with `number` calibrated so each repeat takes at least
+    `target_time` seconds (as timeit.Timer.autorange), repeating until the
+    95% interval on the median per-call time is within `rel_ci` of it, or
+    `max_reps` repeats. Returns (per-call times, number, seconds spent)."""
+    start = time.perf_counter()
+    number = 1
+    while True:
+        t = _time_cell(fn, n, number, setup, extra_globals)
+        if t >= target_time:
+            break
+        number = max(number * 2, int(number * 1.2 * target_time / max(t, 1e-9)))
+    per_call = [t / number]
+    while len(per_call) < max_reps:
+        per_call.append(_time_cell(fn, n, number, setup, extra_globals) / number)
+        if len(per_call) >= min_reps:
+            # normal approximation to the standard error of the median
+            half_width = 1.96 * 1.2533 * np.std(per_call) / np.sqrt(len(per_call))
+            if half_width <= rel_ci * np.median(per_call):
+                break
+    return per_call, number, time.perf_counter() - start
+
+
+last_adaptive_report = {}
+
+
+# the sweep being run by a worker pool; set before the pool forks, so
+# workers inherit fn and extra_globals instead of having them pickled
+_sweep = None
+
+
+def _sweep_cell(i):
+    task, task_args = _sweep
+    return task(*task_args(i))
+
+
+def _pin_worker(counter, cores):
+    # give each pool worker its own core
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {cores[index % len(cores)]})
+
+
+def _fn_key(fn, extra_globals):
+    # identifies the function timed, so a checkpoint is not resumed for another
+    try:
+        source = inspect.getsource(fn)
+    except (OSError, TypeError):
+        code = getattr(fn, "__code__", None)
+        source = repr((code.co_code, code.co_consts)) if code is not None else repr(fn)
+    digest = hashlib.sha1(source.encode("utf8")).hexdigest()
+    return [getattr(fn, "__qualname__", repr(fn)), digest, sorted(extra_globals)]
+
+
+def _load_checkpoint(checkpoint, key):
+    if checkpoint is None or not os.path.exists(checkpoint):
+        return {}
+    with open(checkpoint) as f:
+        saved = json.load(f)
+    # only resume a sweep with the same parameters
+    if saved.get("key") != key:
+        return {}
+    return {tuple(map(int, cell.split(","))): t for cell, t in saved["times"].items()}
+
+
+def _save_checkpoint(checkpoint, key, times):
+    if checkpoint is None:
+        return
+    tmp = checkpoint + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"key": key, "times": {f"{r},{i}": t for (r, i), t in times.items()}}, f)
+    os.replace(tmp, checkpoint)
+
+
 def time_complexity(
-    fn, ns, reps=20, number=1000, plot=True, setup="pass", extra_globals={}
+    fn, ns, reps=20, number=1000, plot=True, setup="pass", extra_globals={},
+    workers=None, shuffle=False, checkpoint=None,
+    target_time=0.02, rel_ci=0.05,
 ):
-    ts = []
-    for rep in range(reps):
-        times = []
-        for n in ns:
-            times.append(
-                timeit.timeit(
-                    "fn(n)",
-                    setup=setup,
-                    globals={**globals(), "fn": fn, "n": n, **extra_globals},
-                    number=number,
-                )
-            )
+    """Time fn(n) for each n in ns, `reps` times, and score how well each
+    of `complexities` fits the median times.
+
+    workers: if given, run the (rep, n) cells on a process pool of that
+    many workers (forked, so fn need not be importable), each pinned to a
+    separate core where the OS allows it.
+    shuffle: run the cells in random order, so slow drift in clock speed
+    or temperature is spread over all n rather than biasing the large ones.
+    checkpoint: file to save timings to as they complete; an interrupted
+    sweep with the same parameters resumes from it (delete it to re-measure).
+    number: calls per timing, or "auto" to calibrate it for each n so a
+    timing lasts at least `target_time` seconds, and to stop repeating once
+    the 95% interval on the median is within `rel_ci` of it (at most
+    `reps` repeats). The time saved against the fixed grid of `reps` x 1000
+    calls is printed and kept in `last_adaptive_report`.
+
+    Returns (ns, mean_times, score_dict)."""
+    adaptive = number == "auto"
+    key = [list(map(float, ns)), reps, number, setup, _fn_key(fn, extra_globals)]
+    times = _load_checkpoint(checkpoint, key)
+    if adaptive:
+        # one cell per n, holding all of its repeats
+        cells = [(0, i) for i in range(len(ns)) if (0, i) not in times]
+        task = _adaptive_cell
+        task_args = lambda i: (fn, ns[i], setup, extra_globals, reps, target_time, rel_ci)
+    else:
+        cells = [(rep, i) for rep in range(reps) for i in range(len(ns)) if (rep, i) not in times]
+        task = _time_cell
+        task_args = lambda i: (fn, ns[i], number, setup, extra_globals)
+    if shuffle:
+        random.shuffle(cells)
+    last_save = time.time()
+
+    def record(cell, t):
+        nonlocal last_save
+        times[cell] = t
+        if adaptive or len(times) % len(ns) == 0:
+            print(".", end="", flush=True)
+        if time.time() - last_save > 1.0:
+            _save_checkpoint(checkpoint, key, times)
+            last_save = time.time()
+
+    if workers:
+        global _sweep
+        cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else [0]
+        ctx = multiprocessing.get_context("fork")
+        counter = ctx.Value("i", 0)
+        _sweep = (task, task_args)
+        try:
+            with ProcessPoolExecutor(
+                workers, mp_context=ctx, initializer=_pin_worker, initargs=(counter, cores)
+            ) as pool:
+                futures = {pool.submit(_sweep_cell, i): (rep, i) for rep, i in cells}
+                for future in as_completed(futures):
+                    record(futures[future], future.result())
+        finally:
+            _sweep = None
+    else:
+        for rep, i in cells:
+            record((rep, i), task(*task_args(i)))
             time.sleep(0.0001) # important for getting timings reliably!
-        print(".", end="", flush=True)
+            if i == len(ns) - 1:
+                time.sleep(0.01)
+    _save_checkpoint(checkpoint, key, times)
 
-        time.sleep(0.01)
-        ts.append(times)
+    if adaptive:
+        per_n = [np.array(times[(0, i)][0]) for i in range(len(ns))]
+        spent = sum(times[(0, i)][2] for i in range(len(ns)))
+        fixed = sum(reps * 1000 * np.median(t) for t in per_n)
+        last_adaptive_report.update(
+            spent=spent, fixed_grid_estimate=fixed, saved=fixed - spent,
+            numbers=[times[(0, i)][1] for i in range(len(ns))],
+            reps=[len(t) for t in per_n],
+        )
+        print(f" adaptive: {spent:.2f}s, fixed grid would take ~{fixed:.2f}s (saved {fixed - spent:.2f}s)")
+    else:
+        per_n = [np.array([times[(rep, i)] for rep in range(reps)]) for i in range(len(ns))]
 
     # compute stats
-    ts = np.array(ts).T
-    ts = ts / np.mean(ts[0])
-    mean_times = np.median(ts, axis=1)
-    std_times = np.std(ts, axis=1)
-    sem_times = 1.96 * (std_times / np.sqrt(reps))
+    scale = np.mean(per_n[0])
+    mean_times = np.array([np.median(t / scale) for t in per_n])
+    std_times = np.array([np.std(t / scale) for t in per_n])
+    sem_times = 1.96 * (std_times / np.sqrt([len(t) for t in per_n]))
 
     # plot complexity curve
     if plot:
@@ -62,32 +320,16 @@ def time_complexity(
         ax.set_frame_on(False)
 
     # fit and score complexities
-    scores = []
-    coeffs = []
-    names = []
-    fns = []
     ns = np.array(ns)
-    ts = np.array(mean_times)
-    for c_name, c_fn in complexities.items():
-        res = scipy.optimize.minimize_scalar(
-            complexity_fit, bracket=[1e-5, 1e5], args=(c_fn, ns, ts)
-        )
-        scores.append(res.fun)
-        coeffs.append(res.x)
-        names.append(c_name)
-        fns.append(c_fn)
-
-    scores = 1.0 / np.sqrt(np.array(scores))
-    tot_score = np.sum(scores)
-    scores = scores / tot_score
+    names, coeffs, residuals, fitted = fit_complexities(ns, mean_times)
+    scores = score_complexities(residuals[0])
 
-    
     if plot:
         print()
-        print(f"Scores for {fn.__name__}")
+        print(f"Scores for {fn.__name__} (log-log slope {loglog_slope(ns, mean_times):.2f})")
         # plot reference curves
-        for score, coeff, fn, name in zip(scores, coeffs, fns, names):
-            ax.plot(ns, fn(ns) * coeff,  alpha=min(1.0, score+0.1), label=name, lw=1+score*5) # 
+        for score, curve, name in zip(scores, fitted[:, 0], names):
+            ax.plot(ns, curve,  alpha=min(1.0, score+0.1), label=name, lw=1+score*5) # 
 
     ord_score = np.argsort(-scores)
     score_dict = {}
@@ -102,6 +344,68 @@ def time_complexity(
 
     return ns, mean_times, score_dict
 
+
+def _peak_memory(fn, n, setup, extra_globals):
+    # peak bytes traced while running fn(n); NumPy reports its array
+    # buffers to tracemalloc, so these are included
+    exec(setup, {**globals(), **extra_globals})
+    tracemalloc.start()
+    fn(n)
+    return tracemalloc.get_traced_memory()[1]
+
+
+def memory_complexity(fn, ns, reps=3, plot=True, setup="pass", extra_globals={}, workers=1, timeout=60.0):
+    """Measure the peak memory allocated by fn(n) for each n in ns and score
+    how well each of `complexities` fits it, as time_complexity does for time.
+    Every measurement runs in a fresh forked process (test_utils.Isolated),
+    so allocations cached by earlier runs do not hide later ones; `workers`
+    run at once, and one that takes over `timeout` seconds is killed.
+
+    Returns (ns, peak_bytes, score_dict), peak_bytes being the median over reps."""
+    from .test_utils import Isolated
+
+    cells = [(rep, i) for rep in range(reps) for i in range(len(ns))]
+    isolated = Isolated(timeout=timeout, workers=workers, preload=())
+    done = isolated.map(
+        [(_peak_memory, (fn, ns[i], setup, extra_globals), {}) for rep, i in cells], results=True
+    )
+    peaks = np.zeros((len(ns), reps))
+    for (rep, i), (ok, result) in zip(cells, done):
+        if not ok:
+            raise RuntimeError(f"memory measurement failed for n={ns[i]}: {result}")
+        peaks[i, rep] = result
+
+    ns = np.array(ns)
+    peak_bytes = np.median(peaks, axis=1)
+    names, coeffs, residuals, fitted = fit_complexities(ns, peak_bytes)
+    scores = score_complexities(residuals[0])
+
+    if plot:
+        fig, ax = plt.subplots(1, 1, figsize=(12, 4))
+        ax.plot(ns, peak_bytes, "k--", zorder=10)
+        ax.fill_between(ns, np.min(peaks, axis=1), np.max(peaks, axis=1), alpha=0.1)
+        ax.set_xlabel("N")
+        ax.set_ylabel("Peak memory (bytes)")
+        ax.set_title("Linear scale memory complexity")
+        ax.set_frame_on(False)
+        print()
+        print(f"Memory scores for {fn.__name__}")
+        for score, curve, name in zip(scores, fitted[:, 0], names):
+            ax.plot(ns, curve, alpha=min(1.0, score + 0.1), label=name, lw=1 + score * 5)
+
+    score_dict = {}
+    for ix in np.argsort(-scores):
+        if plot:
+            print(f"  {names[ix].ljust(12)} {scores[ix]*100.0:4.1f}%")
+        score_dict[names[ix]] = scores[ix]
+
+    if plot:
+        ax.legend()
+        ax.set_ylim(0.0, np.max(peak_bytes) * 1.1)
+
+    return ns, peak_bytes, score_dict
+
+
 if __name__=="__main__":
     import random
     # test sorting sequences of random integers
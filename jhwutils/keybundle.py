@@ -0,0 +1,149 @@
+import ast
+import json
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import numpy as np
+
+# Answer-key bundle: one file holding every key for a notebook.
+#
+#   magic (8 bytes) | TOC length (uint64) | TOC (JSON) | payloads
+#
+# The TOC maps each key name to its entry. Small JSON-able values (hash
+# strings, scalars) are stored inline in the TOC. Arrays are stored as raw
+# C-ordered buffers, aligned to 64 bytes, and are returned as read-only views
+# of the memory map, so pages are shared between processes. Anything else is
+# pickled and only unpickled when first looked up.
+
+MAGIC = b"JHWKEYS\x01"
+_ALIGN = 64
+
+
+def _inline(value):
+    try:
+        # only values that survive a JSON round trip unchanged (no tuples)
+        return json.loads(json.dumps(value)) == value
+    except (TypeError, ValueError):
+        return False
+
+
+def dtype_descr(dtype):
+    """A string describing `dtype`, including the fields of structured dtypes."""
+    return repr(np.lib.format.dtype_to_descr(dtype))
+
+
+def descr_dtype(descr):
+    """The dtype described by a `dtype_descr` string."""
+    return np.lib.format.descr_to_dtype(ast.literal_eval(descr))
+
+
+def write_bundle(fname, keys, checks=None):
+    """Write `keys` (a dict of name -> value) to a bundle file.
+    `checks` optionally maps names to the checkarr check kind that verifies
+    them ("hash", "strict", "moment", "scalar" or "string")."""
+    checks = checks or {}
+    toc, payloads, offset = {}, [], 0
+    for name, value in keys.items():
+        entry = {}
+        if name in checks:
+            entry["check"] = checks[name]
+        if isinstance(value, np.generic):
+            value = value.item()
+        if isinstance(value, np.ndarray) and not value.dtype.hasobject:
+            data = value.tobytes()
+            entry.update(kind="array", dtype=dtype_descr(value.dtype), shape=value.shape)
+        elif _inline(value):
+            entry.update(kind="json", value=value)
+            data = None
+        else:
+            data = pickle.dumps(value)
+            entry["kind"] = "pickle"
+        if data is not None:
+            entry.update(offset=offset, length=len(data))
+            payloads.append(data + b"\0" * (-len(data) % _ALIGN))
+            offset += len(payloads[-1])
+        toc[name] = entry
+
+    header = json.dumps(toc).encode("utf8")
+    header += b" " * (-(len(header) + 16) % _ALIGN)
+    # write then rename, so a process with the old bundle mapped keeps
+    # reading the old file rather than a truncated one
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(fname)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC + struct.pack("<Q", len(header)) + header)
+            for data in payloads:
+                f.write(data)
+        os.replace(tmp, fname)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class KeyBundle:
+    """Read-only, memory-mapped view of a bundle file. Only the table of
+    contents is parsed on open; each key is decoded when first looked up."""
+
+    def __init__(self, fname):
+        with open(fname, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            stat = os.fstat(f.fileno())
+            self.version = (stat.st_ino, stat.st_mtime_ns)
+        if self._map[:8] != MAGIC:
+            raise ValueError(f"{fname} is not an answer-key bundle")
+        (toc_len,) = struct.unpack_from("<Q", self._map, 8)
+        self._base = 16 + toc_len
+        self.toc = json.loads(self._map[16 : self._base])
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self.toc
+
+    def __len__(self):
+        return len(self.toc)
+
+    def keys(self):
+        return self.toc.keys()
+
+    def check_kind(self, name):
+        return self.toc[name].get("check")
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self._values:
+                self._values[name] = self._decode(self.toc[name])
+            return self._values[name]
+
+    def _decode(self, entry):
+        if entry["kind"] == "json":
+            return entry["value"]
+        start = self._base + entry["offset"]
+        if entry["kind"] == "array":
+            dtype = descr_dtype(entry["dtype"])
+            count = entry["length"] // dtype.itemsize if dtype.itemsize else 0
+            arr = np.frombuffer(self._map, dtype, count=count, offset=start)
+            return arr.reshape(entry["shape"])
+        return pickle.loads(self._map[start : start + entry["length"]])
+
+
+_bundles = {}
+_bundles_lock = threading.Lock()
+
+
+def open_bundle(fname):
+    """The KeyBundle for `fname`, opened once per process (and again if the
+    file has been rewritten since). Worker processes forked after opening
+    share its pages read-only."""
+    if isinstance(fname, KeyBundle):
+        return fname
+    key = os.path.abspath(fname)
+    stat = os.stat(key)
+    with _bundles_lock:
+        bundle = _bundles.get(key)
+        if bundle is None or bundle.version != (stat.st_ino, stat.st_mtime_ns):
+            bundle = _bundles[key] = KeyBundle(key)
+        return bundle
@@ -4,6 +4,19 @@ from IPython.display import display, HTML
 import inspect
 import timeit
 import binascii 
+import gc
+import math
+import time
+import numpy as np
+import scipy.stats
+import json
+import os
+import platform
+import tempfile
+import importlib
+import multiprocessing
+import multiprocessing.connection
+
 
 def case_crc(s):
     h_crc = binascii.crc32(bytes(s.lower(), "ascii"))
@@ -30,21 +43,326 @@ def should_pass(test_fn, *args, **kwargs):
     return True
 
 
+def _run_probe(test_fn, args, kwargs, max_memory, send_result, conn):
+    # runs in the forked child: apply the memory cap, then report back
+    try:
+        if max_memory is not None:
+            # max_memory bytes beyond what the child inherited, as for tick.Marks
+            import resource
+            from .tick import _address_space
+            limit = _address_space() + max_memory
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        result = test_fn(*args, **kwargs)
+        conn.send((True, result if send_result else None))
+    except BaseException as e:
+        conn.send((False, "{}: {}".format(type(e).__name__, e)))
+    finally:
+        conn.close()
+        os._exit(0)
+
+
+class Isolated:
+    """should_pass / should_fail that run each test in a child forked from
+    this (already warm) process, so a crash, runaway loop or memory blowup
+    fails that test instead of killing the grader. `max_memory` bounds the
+    address space each test may add to what it inherits.
+
+        iso = Isolated(timeout=5, max_memory=2**30)
+        iso.should_fail(test_fn, broken_answer)
+        iso.map([(test_fn, (answer,), {}), ...])   # run probes concurrently
+
+    Children are forked from the calling thread, which also waits on them,
+    so no extra threads are started (forking a process that is running
+    other threads can deadlock the child, and Python 3.12+ warns about it).
+    """
+
+    def __init__(self, timeout=10.0, max_memory=None, workers=None, preload=("numpy", "scipy")):
+        self.timeout = timeout
+        self.max_memory = max_memory
+        self.workers = workers or os.cpu_count()
+        self._ctx = multiprocessing.get_context("fork")
+        # import these once here so no child pays for them
+        for module in preload:
+            try:
+                importlib.import_module(module)
+            except ImportError:
+                pass
+
+    def run(self, test_fn, *args, **kwargs):
+        """Run test_fn(*args, **kwargs) in a child. Returns (passed, reason)."""
+        return self.map([(test_fn, args, kwargs)])[0]
+
+    def map(self, probes, results=False):
+        """Run (test_fn, args, kwargs) probes, up to `workers` at once,
+        returning a (passed, reason) pair for each, in order. With results=True,
+        a passing probe's pair holds test_fn's (picklable) return value instead."""
+        probes = list(probes)
+        out = [None] * len(probes)
+        started = 0
+        running = {}
+        try:
+            while True:
+                while started < len(probes) and len(running) < self.workers:
+                    i, (test_fn, args, kwargs) = started, probes[started]
+                    started += 1
+                    recv, send = self._ctx.Pipe(duplex=False)
+                    proc = self._ctx.Process(
+                        target=_run_probe, args=(test_fn, args, kwargs, self.max_memory, results, send)
+                    )
+                    proc.start()
+                    send.close()
+                    deadline = time.monotonic() + self.timeout if self.timeout is not None else math.inf
+                    running[recv] = (i, proc, deadline)
+                if not running:
+                    return out
+                wait = min(deadline for _, _, deadline in running.values()) - time.monotonic()
+                ready = multiprocessing.connection.wait(list(running), None if wait == math.inf else max(wait, 0))
+                for recv in ready:
+                    i, proc, _ = running.pop(recv)
+                    try:
+                        out[i] = recv.recv()
+                    except EOFError:
+                        proc.join()
+                        out[i] = (False, "crashed with exit code {}".format(proc.exitcode))
+                    recv.close()
+                    proc.join()
+                for recv, (i, proc, deadline) in list(running.items()):
+                    if deadline <= time.monotonic():
+                        proc.kill()
+                        proc.join()
+                        recv.close()
+                        del running[recv]
+                        out[i] = (False, "timed out after {}s".format(self.timeout))
+        finally:
+            for recv, (i, proc, _) in running.items():
+                proc.kill()
+                proc.join()
+                recv.close()
+
+    def should_fail(self, test_fn, *args, **kwargs):
+        passed, _ = self.run(test_fn, *args, **kwargs)
+        if passed:
+            raise AssertionError("Test passed but should not have!")
+        return True
+
+    def should_pass(self, test_fn, *args, **kwargs):
+        passed, reason = self.run(test_fn, *args, **kwargs)
+        if not passed:
+            raise AssertionError("Test did not pass but should have! ({})".format(reason))
+        return True
+
+
+
+def _t95(n):
+    # two-sided 95% Student t multiplier for n samples
+    return scipy.stats.t.ppf(0.975, n - 1) if n > 1 else np.inf
+
+
+def _number(fn):
+    # calls per timed section, enough that each section takes ~0.2s;
+    # also serves as the warmup run
+    number, _ = timeit.Timer(fn).autorange()
+    return number
+
+
+def _time_calls(fn, number):
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        return (time.perf_counter() - start) / number
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def _interleaved(fns, min_reps=5, max_reps=200, max_time=10.0, rel_ci=0.1, paired=True):
+    """Time each of fns in rounds, alternating their order each round so
+    drift affects them equally, until the 95% interval on the mean log
+    time (or, if paired, log ratio of the first to each other fn) is within
+    rel_ci, or max_time has passed. Returns log per-call times, (rounds, len(fns))."""
+    numbers = [_number(fn) for fn in fns]
+    deadline = time.perf_counter() + max_time
+    half_width = math.log1p(rel_ci)
+    rounds = []
+    while len(rounds) < max_reps:
+        order = range(len(fns)) if len(rounds) % 2 == 0 else reversed(range(len(fns)))
+        times = [0.0] * len(fns)
+        for i in order:
+            times[i] = _time_calls(fns[i], numbers[i])
+        rounds.append(np.log(times))
+        if len(rounds) >= min_reps:
+            logs = np.array(rounds)
+            if paired and len(fns) > 1:
+                logs = logs[:, :1] - logs[:, 1:]
+            halves = [_mean_interval(col)[1] for col in logs.T]
+            if max(halves) <= half_width or time.perf_counter() > deadline:
+                break
+    return np.array(rounds)
+
+
+def _mean_interval(logs):
+    # mean of logs and the half-width of its 95% interval
+    if len(logs) < 2:
+        return np.mean(logs), np.inf
+    return np.mean(logs), _t95(len(logs)) * np.std(logs, ddof=1) / np.sqrt(len(logs))
+
+
+def test_execution_time(slow, fast, interval=False, rel_ci=0.1, max_time=10.0, cache=False, max_age=7 * 86400):
+    """How many times faster fast() runs than slow(). Both are warmed up,
+    then timed in interleaved rounds with the garbage collector off, until
+    the 95% confidence interval on the ratio is within +-rel_ci or max_time
+    seconds have been spent. If interval is True, returns (ratio, (lo, hi)).
+
+    If cache is True, slow()'s timing is cached on disk for this host (see
+    baseline_key) for max_age seconds, and later calls only time fast()."""
+    key = baseline_key(slow) if cache else None
+    cached = _cached_baseline(key, max_age) if key else None
+    if cached is None:
+        logs = _interleaved([slow, fast], rel_ci=rel_ci, max_time=max_time)
+        if key:
+            _store_baseline(key, logs[:, 0])
+        return _exp_interval(*_mean_interval(logs[:, 0] - logs[:, 1]), interval)
+    slow_mean, slow_half = cached
+    fast_mean, fast_half = _mean_interval(_interleaved([fast], rel_ci=rel_ci, max_time=max_time)[:, 0])
+    return _exp_interval(slow_mean - fast_mean, math.hypot(slow_half, fast_half), interval)
+
+
+def _exp_interval(mean, half, interval):
+    if interval:
+        return math.exp(mean), (math.exp(mean - half), math.exp(mean + half))
+    return math.exp(mean)
 
-def test_execution_time(slow, fast):
-    
-    base_time = timeit.timeit("slow()", globals={"slow":slow}, number=1)
-    fast_time = timeit.timeit("fast()", globals={"fast":fast}, number=1)
 
-    ratio = base_time / fast_time
-    return ratio
+# Host calibration: a fixed reference workload is timed once per host and
+# cached on disk, so timings can be expressed in units of it and compared
+# between machines of different speeds.
 
+_calibration = {}
 
-def report_execution_time(fast):
 
-    ratio = test_execution_time(_crack_the_code_slow, fast)
+def cache_dir():
+    """Directory for jhwutils' on-disk caches: $JHWUTILS_CACHE, or ~/.cache/jhwutils"""
+    path = os.environ.get("JHWUTILS_CACHE") or os.path.join(os.path.expanduser("~"), ".cache", "jhwutils")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _load_cache(name):
+    try:
+        with open(os.path.join(cache_dir(), name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(name, data):
+    # write then rename, so concurrent graders never read a partial file
+    path = cache_dir()
+    fd, tmp = tempfile.mkstemp(dir=path, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp, os.path.join(path, name))
+
+
+def _cpu_model():
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def host_key():
+    """Identifies this host and interpreter for cached timings"""
+    return "|".join([platform.node(), _cpu_model(), platform.python_implementation(), platform.python_version()])
+
+
+def _reference_workload():
+    # interpreter-bound loops and a little NumPy, like typical exercise code
+    xs = [(i * 7919) % 10007 for i in range(20000)]
+    xs.sort()
+    total = 0
+    for x in xs:
+        total += x & 0xFF
+    a = np.arange(4096.0).reshape(64, 64)
+    return total + float(np.trace(a @ a))
+
+
+def calibrate(force=False):
+    """Seconds per call of the reference workload on this host. Measured
+    once per host and cached on disk; force=True measures it again."""
+    key = host_key()
+    if not force and key in _calibration:
+        return _calibration[key]
+    cache = _load_cache("calibration.json")
+    if force or key not in cache:
+        logs = _interleaved([_reference_workload], rel_ci=0.02, max_time=5.0)
+        cache = _load_cache("calibration.json")
+        cache[key] = {"seconds": math.exp(np.mean(logs)), "measured": time.time()}
+        _save_cache("calibration.json", cache)
+    _calibration[key] = cache[key]["seconds"]
+    return _calibration[key]
+
+
+def normalised_time(fn, interval=False, rel_ci=0.1, max_time=10.0):
+    """Time per call of fn(), in units of this host's reference workload
+    (see calibrate), so that timings from different machines are comparable.
+    If interval is True, returns (units, (lo, hi))."""
+    logs = _interleaved([fn], rel_ci=rel_ci, max_time=max_time)
+    return _exp_interval(*_mean_interval(logs[:, 0] - math.log(calibrate())), interval)
+
+
+# Cached baseline timings, so the deliberately slow reference side of a
+# speed check is measured once per host rather than once per submission
+
+def baseline_key(fn):
+    """Cache key for fn's timing: its source, the host and the NumPy version.
+    None if the source is not available."""
+    try:
+        source = inspect.getsource(fn)
+    except (OSError, TypeError):
+        return None
+    return sha1("\n".join([source, host_key(), np.__version__]).encode("utf8")).hexdigest()
+
+
+def _cached_baseline(key, max_age):
+    entry = _load_cache("baselines.json").get(key)
+    if entry is None or time.time() - entry["measured"] > max_age:
+        return None
+    return entry["mean"], entry["half"]
+
+
+def _store_baseline(key, logs, max_age=30 * 86400):
+    mean, half = _mean_interval(logs)
+    now = time.time()
+    cache = {k: v for k, v in _load_cache("baselines.json").items() if now - v["measured"] < max_age}
+    cache[key] = {"mean": mean, "half": half, "measured": now}
+    _save_cache("baselines.json", cache)
+
+
+def clear_baselines():
+    """Forget every cached baseline timing"""
+    _save_cache("baselines.json", {})
+
+
+def report_execution_time(fast, baseline_units=None, cache=True):
+    """Grade fast() on how many times faster than _crack_the_code_slow() it is.
+    If baseline_units (normalised_time(_crack_the_code_slow), measured once on
+    any machine) is given, the slow baseline is not run here; otherwise its
+    timing is cached per host if cache is True."""
+    if baseline_units is None:
+        ratio, (lo, hi) = test_execution_time(_crack_the_code_slow, fast, interval=True, cache=cache)
+    else:
+        units, (lo, hi) = normalised_time(fast, interval=True)
+        ratio, lo, hi = baseline_units / units, baseline_units / hi, baseline_units / lo
     print()
-    print("Speed ratio: {ratio:.1f}x faster".format(ratio=ratio))
+    print("Speed ratio: {ratio:.1f}x faster (95% interval {lo:.1f}x to {hi:.1f}x)".format(ratio=ratio, lo=lo, hi=hi))
 
     if ratio>2 and ratio<5:
         print("A little faster, but way too slow")
@@ -70,9 +388,22 @@ def short_hash(v):
     sha = sha1(str(v).encode('utf8')).hexdigest()[0:8]
     return sha
 
+def _debugging():
+    # a trace function means a debugger (or tracer) is attached; without
+    # one, bdb frames on the stack still mean e.g. a %debug prompt. The walk
+    # reads only code filenames, so it takes microseconds
+    if sys.gettrace() is not None:
+        return True
+    frame = sys._getframe(1)
+    while frame is not None:
+        if 'bdb' in frame.f_code.co_filename:
+            return True
+        frame = frame.f_back
+    return False
+
+
 def fail_if_debug():
-    debugging = any(['bdb' in f.filename for f in inspect.getouterframes(inspect.currentframe())])
-    if debugging or sys.gettrace() is not None:
+    if _debugging():
         display(HTML('<marquee> <div class="alert alert-box alert-danger"> <h1> Hey, I told you not to use the debugger </h1> </div> </marquee>'))
         boom(shake_times=5, duration=10.5, p=1.0)
         raise Exception("User cannot follow instructions, cat detonated.")        
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-from distutils.core import setup
+from setuptools import setup
 
 setup(name='jhwutils',
       version='1.3.1',
@@ -11,4 +11,6 @@ setup(name='jhwutils',
       packages=['jhwutils'],
       include_package_data=True,
       package_data={"jhwutils": ["*.css"]},
+      # xxhash makes checkarr's hash cache digests several times faster
+      extras_require={"fast": ["xxhash"]},
      )
\ No newline at end of file
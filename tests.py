@@ -0,0 +1,215 @@
+import numpy as np
+from jhwutils import checkarr
+
+# inputs the streamed hashes must agree with the direct NumPy forms on
+hash_cases = [
+    np.array([1.0, -np.inf, 3.0]),
+    np.array([1.0, np.inf, 3.0]),
+    np.array([np.inf, -np.inf, 1.0]),
+    np.log(np.array([0.0, 0.5, 1.0, 0.0])),
+    np.array([np.nan, 1.0, 2.0, np.nan]),
+    np.array([np.nan, np.nan]),
+    np.arange(12, dtype=np.int32).reshape(3, 4),
+    np.array([[True, False], [False, True]]),
+    np.random.default_rng(0).normal(size=(50, 40)),
+    np.random.default_rng(1).integers(-100, 100, size=(7, 5, 3)),
+    np.array([0.1 + 0.2, 0.3, 0.3]),
+    np.array([0.0, 1e-320]),
+    np.array([-1.7e308, 1.7e308, 0.0]),
+]
+
+
+def _same(a, b):
+    return np.allclose(a, b, rtol=1e-5, atol=1e-5, equal_nan=True)
+
+
+def _strict_reference(arr):
+    ix = np.meshgrid(*[np.arange(i) for i in arr.shape], indexing="ij")
+    return checkarr._array_hash_direct(np.mean([i * arr for i in ix], axis=0))
+
+
+def test_array_hash_matches_direct():
+    for arr in hash_cases:
+        shape, stats = checkarr.array_hash(arr)
+        ref_shape, ref_stats = checkarr._array_hash_direct(arr)
+        assert shape == ref_shape and _same(stats, ref_stats), arr
+
+
+def test_array_hash_file_matches_direct(tmp_path):
+    for i, arr in enumerate(hash_cases):
+        fname = tmp_path / f"{i}.npy"
+        np.save(fname, arr)
+        shape, stats = checkarr.array_hash_file(fname)
+        assert _same(stats, checkarr._array_hash_direct(arr)[1]), arr
+
+
+def test_array_hash_workers_and_blocks():
+    arr = np.random.default_rng(2).normal(size=10007)
+    ref = checkarr._array_hash_direct(arr)[1]
+    assert _same(checkarr.array_hash(arr, chunk_size=100, workers=4)[1], ref)
+
+
+def test_moment_hash_matches_direct():
+    for arr in hash_cases:
+        shape_hash = hex(checkarr.crc32(f"{arr.shape}".encode("utf8")))
+        stats = checkarr._moment_stats_direct(np.array(arr.ravel(), dtype=np.float64))
+        ref = shape_hash[2:] + checkarr._check_scalar(np.nansum(stats))[2:]
+        assert checkarr.moment_hash(arr) == ref, arr
+
+
+def test_strict_array_hash_matches_direct():
+    for arr in hash_cases:
+        shape, stats = checkarr.strict_array_hash(arr)
+        assert _same(stats, _strict_reference(arr)[1]), arr
+
+
+def test_histogram_median_narrow_ranges():
+    rng = np.random.default_rng(3)
+    for arr in [
+        1.0 + np.spacing(1.0) * rng.integers(0, 50, size=200001),
+        np.concatenate([rng.normal(size=100001), [1e300, -1e300]]),
+    ]:
+        fill = checkarr._copy_fill(arr)
+        median = checkarr._histogram_median(fill, len(arr), arr.min(), arr.max(), len(arr), budget=100)
+        assert median == np.median(arr)
+
+
+def test_mark_registry_grows_past_capacity():
+    from jhwutils import tick
+
+    registry = tick.MarkRegistry(capacity=4)
+    for i in range(10):
+        registry.register(f"q{i}", 2)
+        registry.award(f"q{i}", i % 3)
+    assert registry.totals() == (sum(i % 3 for i in range(10)), 20)
+    records = registry.records()
+    assert [r["id"] for r in records] == [f"q{i}" for i in range(10)]
+    assert [r["achieved"] for r in records] == [i % 3 for i in range(10)]
+
+
+def _bucket_check_both(values, hashes):
+    # the array and scalar forms of check_bucket must agree
+    mask = checkarr.check_buckets(values, hashes)
+    assert list(mask) == [checkarr.check_bucket(v, hex(int(h))) for v, h in zip(values, hashes)]
+    return mask
+
+
+def test_bucket_within_half_bucket():
+    rng = np.random.default_rng(4)
+    refs = rng.uniform(1, 10, size=2000) * 10.0 ** rng.integers(-200, 200, size=2000)
+    refs *= rng.choice([-1, 1], size=2000)
+    widths = 10.0 ** (np.floor(np.log10(np.abs(refs))) - 5)
+    values = refs + rng.uniform(-0.499, 0.499, size=2000) * widths
+    hashes = checkarr.bucket_hashes(refs)
+    assert [hex(int(h)) for h in hashes] == [checkarr.bucket_hash(r) for r in refs]
+    assert _bucket_check_both(values, hashes).all()
+    assert not _bucket_check_both(refs + 3 * widths, hashes).any()
+
+
+def test_bucket_near_powers_of_ten():
+    powers = 10.0 ** np.arange(-30, 30)
+    below, above = powers * (1 - 2e-7), powers * (1 + 2e-7)
+    assert _bucket_check_both(above, checkarr.bucket_hashes(below)).all()
+    assert _bucket_check_both(below, checkarr.bucket_hashes(above)).all()
+
+
+def test_bucket_special_values():
+    specials = np.array([0.0, -0.0, np.nan, np.inf, -np.inf])
+    hashes = checkarr.bucket_hashes(specials)
+    assert _bucket_check_both(specials, hashes).all()
+    assert _bucket_check_both(np.array([-0.0, 0.0]), hashes[:2]).all()
+    assert not _bucket_check_both(np.array([-np.inf, np.inf, 0.0, np.nan]), hashes[[3, 4, 2, 0]]).any()
+
+
+def test_nested_profile_peaks():
+    from jhwutils import tick
+
+    tick.set_profiling(True)
+    tick.reset_profiles()
+    try:
+        with tick._measure("outer", None):
+            a = np.ones(10 ** 6)
+            del a
+            with tick._measure("inner", None):
+                pass
+    finally:
+        tick.set_profiling(False)
+    peaks = {p["id"]: p["peak_memory"] for p in tick.check_profiles()}
+    assert peaks["outer"] >= 8 * 10 ** 6 > peaks["inner"]
+
+
+def test_verify_batch_isolates_bad_rows():
+    arr = np.arange(6.0).reshape(2, 3)
+    pairs = [
+        (arr, checkarr.array_hash(arr), "hash"),
+        (None, checkarr.array_hash(arr), "hash"),
+        (1.5, checkarr._check_scalar(1.5), "scalar"),
+        ("x", checkarr._check_scalar(1.5), "scalar"),
+        (2.5, "not hex", "scalar"),
+        (3, "0x0", "string"),
+        ("Abc", hex(checkarr.crc32(b"abc")), "string"),
+    ]
+    results = checkarr.verify_batch(pairs)
+    assert list(results["ok"]) == [True, False, True, False, False, False, True]
+    assert "Error" in results["got"][1] and "Error" in results["got"][5]
+
+
+def test_headless_outcomes_per_thread():
+    import threading
+    from jhwutils import tick
+
+    tick.set_headless(True)
+    try:
+        def notebook(n, out):
+            tick.set_registry(tick.MarkRegistry())
+            for i in range(n):
+                with tick.tick():
+                    pass
+            out.append(tick.headless_record()["outcomes"])
+
+        out = []
+        threads = [threading.Thread(target=notebook, args=(n, out)) for n in (2, 5)]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+    finally:
+        tick.set_headless(False)
+    assert sorted(len(o) for o in out) == [2, 5]
+    for outcomes in out:
+        for kind, id, marks, achieved, reason in outcomes:
+            assert kind == "tick" and id.startswith("tick@") and achieved == 1
+
+
+def test_hashes_of_non_c_ordered_arrays(tmp_path):
+    base = np.random.default_rng(5).normal(size=(30, 20, 7))
+    base[3, 4, 5] = np.inf
+    for arr in [base.T, base[::2, 1:, ::3], np.asfortranarray(base)]:
+        copy = np.ascontiguousarray(arr)
+        assert _same(checkarr.array_hash(arr)[1], checkarr._array_hash_direct(copy)[1])
+        assert _same(checkarr.strict_array_hash(arr)[1], _strict_reference(copy)[1])
+        np.save(tmp_path / "a.npy", arr)
+        assert _same(checkarr.array_hash_file(tmp_path / "a.npy")[1], checkarr._array_hash_direct(copy)[1])
+
+
+def test_hash_cache_hits_and_misses(tmp_path):
+    a, b = np.arange(100.0), np.arange(100.0) + 1
+    try:
+        checkarr.enable_hash_cache(maxsize=1)
+        first = checkarr.array_hash(a)
+        assert checkarr.array_hash(a.copy()) == first
+        checkarr.array_hash(b)  # evicts a
+        checkarr.array_hash(a)
+        info = checkarr.hash_cache_info()
+        assert (info.hits, info.misses, info.currsize) == (1, 3, 1)
+
+        path = str(tmp_path / "hashes.sqlite")
+        checkarr.enable_hash_cache(maxsize=1, path=path)
+        checkarr.moment_hash(a)
+        checkarr.moment_hash(b)
+        checkarr.enable_hash_cache(maxsize=4, path=path)  # a fresh process
+        assert checkarr.moment_hash(a) == checkarr.moment_hash.__wrapped__(a)
+        checkarr.moment_hash(b)
+        checkarr.moment_hash(a)
+        info = checkarr.hash_cache_info()
+        assert (info.hits, info.misses, info.disk_hits) == (1, 0, 2)
+    finally:
+        checkarr.disable_hash_cache()